@@ -54,6 +54,8 @@ class GitQuickAddCommand(WindowCommand, GitCmd, GitStatusHelper):
             return
 
         status = self.get_status_list(repo)
+        if status is None:
+            return
 
         def on_done(idx):
             if idx == -1:
@@ -83,7 +85,10 @@ class GitQuickAddCommand(WindowCommand, GitCmd, GitStatusHelper):
         self.window.show_quick_panel(status, on_done, sublime.MONOSPACE_FONT)
 
     def get_status_list(self, repo):
-        status = [l[1:] for l in self.get_porcelain_status(repo) if l[1] != ' ']
+        lines = self.get_porcelain_status(repo)
+        if lines is None:
+            return None
+        status = [l[1:] for l in lines if l[1] != ' ']
         if not status:
             return [GIT_ADD_CLEAN]
         if len(status) > 1:
@@ -1,5 +1,12 @@
 # coding: utf-8
-import re
+import os
+import sys
+import json
+import hashlib
+import logging
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
 from datetime import datetime
 import sublime
 from sublime_plugin import TextCommand, WindowCommand, EventListener
@@ -9,11 +16,20 @@ from .cmd import GitCmd
 from .helpers import GitStatusHelper, GitRepoHelper
 
 
+logger = logging.getLogger('SublimeGit.blame')
+
 GIT_BLAME_TITLE_PREFIX = '*git-blame*: '
 GIT_BLAME_SYNTAX = 'Packages/SublimeGit/syntax/SublimeGit Blame.tmLanguage'
 
+# the sha git blame uses for lines which haven't been committed yet
+ZERO_SHA = '0' * 40
+
+# bump the version whenever the format of the cached blame data changes
+GIT_BLAME_CACHE_VERSION = 5
+GIT_BLAME_CACHE_SIZE = 50
+
 
-from threading import Thread
+from threading import Thread, current_thread
 from time import time
 from functools import wraps, partial
 
@@ -54,6 +70,12 @@ class AsyncByView:
     def __init__(self, title: str):
         self.title = title
         self.running_view_ids = set()
+        # progress messages by the thread doing the work, since that thread
+        # doesn't know which view the monitor shows its status in
+        self.progress = {}
+
+    def set_progress(self, progress):
+        self.progress[current_thread()] = progress
 
     @decorator
     def __call__(self, wrapped, args, kwargs):
@@ -73,16 +95,147 @@ class AsyncByView:
         while run_thread.is_alive():
             run_thread.join(self.PROGRESS_INTERVAL_S)
             elapsed = time() - start_time
-            view.set_status(self.title, "Running {}: {:.0f}s".format(self.title, elapsed))
+            status = "Running {}: {:.0f}s".format(self.title, elapsed)
+            progress = self.progress.get(run_thread)
+            if progress:
+                status += " ({})".format(progress)
+            view.set_status(self.title, status)
 
         view.erase_status(self.title)
+        self.progress.pop(run_thread, None)
         self.running_view_ids.remove(view.id())
 
 
+blame_async = AsyncByView("Blame")
+
 
 class GitBlameCache(object):
-    commits = {}
-    lines = {}
+    """
+    Parsed blame results for open blame views, indexed by view id.
+
+    Instead of a sha per line, the commit of each line is stored as an index
+    into a list of shas, packed into an array.
+
+    Entries are removed when their view is closed. In case a close was
+    missed, entries of views which aren't open anymore are dropped once
+    there are more than SIZE of them. Open views are never evicted, since
+    their results can't be looked up any other way.
+    """
+    SIZE = 32
+
+    entries = {}
+
+    @classmethod
+    def get(cls, view_id):
+        entry = cls.entries.get(view_id)
+        if entry is None:
+            return None, None, None
+        return entry['commits'], entry['shas'], entry['line_commits']
+
+    @classmethod
+    def get_offsets(cls, view_id):
+        entry = cls.entries.get(view_id)
+        return entry.get('offsets') if entry else None
+
+    @classmethod
+    def set(cls, view_id, commits, line_shas):
+        sha_to_idx = {}
+        for sha in line_shas:
+            if sha not in sha_to_idx:
+                sha_to_idx[sha] = len(sha_to_idx)
+
+        shas = sorted(sha_to_idx, key=sha_to_idx.get)
+        line_commits = array('I', (sha_to_idx[sha] for sha in line_shas))
+        cls.entries[view_id] = {'commits': commits, 'shas': shas, 'line_commits': line_commits}
+        if len(cls.entries) > cls.SIZE:
+            cls.discard_closed()
+
+    @classmethod
+    def set_offsets(cls, view_id, text):
+        # partial results are shown before there's an entry, and don't need offsets
+        entry = cls.entries.get(view_id)
+        if entry:
+            entry['offsets'] = get_line_offsets(text)
+
+    @classmethod
+    def discard(cls, view_id):
+        cls.entries.pop(view_id, None)
+
+    @classmethod
+    def discard_closed(cls):
+        open_ids = set(v.id() for w in sublime.windows() for v in w.views())
+        for view_id in list(cls.entries):
+            if view_id not in open_ids:
+                del cls.entries[view_id]
+
+
+def get_line_offsets(text):
+    """Return the offset of the start of each line in text."""
+    return [0] + list(accumulate(len(l) + 1 for l in text.split('\n')))[:-1]
+
+
+def row_at_point(offsets, point):
+    return bisect_right(offsets, point) - 1
+
+
+class GitBlameDiskCache(object):
+    """
+    Parsed blame results, stored as json files in the Sublime cache directory.
+
+    Entries are keyed by the commit being blamed (and, when blaming the working
+    copy, the hash of the file contents), so they never need to be invalidated.
+    Only the most recently used entries are kept.
+    """
+
+    def get_cache_dir(self):
+        return os.path.join(sublime.cache_path(), 'SublimeGit', 'blame')
+
+    def get_cache_key(self, repo, filename, revision=None):
+        rc, commit, _ = self.git(['rev-parse', '--verify', '-q', revision if revision else 'HEAD'], cwd=repo)
+        if rc != 0:
+            return None
+
+        content = ''
+        if not revision:
+            rc, content, _ = self.git(['hash-object', '--', filename], cwd=repo)
+            if rc != 0:
+                return None
+
+        key = u'\0'.join([str(GIT_BLAME_CACHE_VERSION), repo, filename, commit.strip(), content.strip()])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def load_cached_blame(self, key):
+        path = os.path.join(self.get_cache_dir(), key + '.json')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                commits, line_shas, line_contents = json.load(f)
+            line_shas = [sys.intern(sha) for sha in line_shas]
+            # mark as recently used
+            os.utime(path, None)
+            return commits, line_shas, line_contents
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save_cached_blame(self, key, commits, line_shas, line_contents):
+        cache_dir = self.get_cache_dir()
+        path = os.path.join(cache_dir, key + '.json')
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            tmp = path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump([commits, line_shas, line_contents], f)
+            os.replace(tmp, path)
+
+            # evict the least recently used entries
+            entries = [os.path.join(cache_dir, n) for n in os.listdir(cache_dir) if n.endswith('.json')]
+            entries.sort(key=os.path.getmtime, reverse=True)
+            for entry in entries[GIT_BLAME_CACHE_SIZE:]:
+                os.remove(entry)
+        except (IOError, OSError) as e:
+            logger.warning('Could not write blame cache %s: %s', path, e)
+
 
 class GitBlameCommand(WindowCommand, GitCmd, GitStatusHelper):
     """
@@ -118,8 +271,10 @@ class GitBlameCommand(WindowCommand, GitCmd, GitStatusHelper):
     """
 
     def run(self, repo=None, filename=None, revision=None):
+        active_view = self.window.active_view()
+
         # check if file is saved
-        filename = filename if filename else self.window.active_view().file_name()
+        filename = filename if filename else active_view.file_name()
         if not filename:
             sublime.error_message('Cannot do git-blame on unsaved files.')
             return
@@ -141,11 +296,11 @@ class GitBlameCommand(WindowCommand, GitCmd, GitStatusHelper):
 
         # figure out where we are in the file
         rows = []
-        sel = self.window.active_view().sel()
+        sel = active_view.sel()
         if sel:
             for s in sel:
-                for l in self.window.active_view().lines(s):
-                    row, _ = self.window.active_view().rowcol(l.begin())
+                for l in active_view.lines(s):
+                    row, _ = active_view.rowcol(l.begin())
                     rows.append(row)
 
         title = GIT_BLAME_TITLE_PREFIX + filename.replace(repo, '').lstrip('/\\')
@@ -164,7 +319,6 @@ class GitBlameCommand(WindowCommand, GitCmd, GitStatusHelper):
             view.window().focus_view(view)
             return
 
-        active_view = self.window.active_view()
         view = self.window.new_file()
         # new_file() steals focus, bring it back
         self.window.focus_view(active_view)
@@ -173,115 +327,235 @@ class GitBlameCommand(WindowCommand, GitCmd, GitStatusHelper):
         view.set_read_only(True)
         view.set_syntax_file(GIT_BLAME_SYNTAX)
 
-        view.settings().set('word_wrap', False)
-        view.settings().set('git_view', 'blame')
-        view.settings().set('git_repo', repo)
-        view.settings().set('git_blame_file', filename)
-        view.settings().set('git_blame_rev', revision)
+        settings = view.settings()
+        settings.set('word_wrap', False)
+        settings.set('git_view', 'blame')
+        settings.set('git_repo', repo)
+        settings.set('git_blame_file', filename)
+        settings.set('git_blame_rev', revision)
         view.run_command('git_blame_refresh', {'filename': filename, 'revision': revision, 'rows': rows})
 
 
-class GitBlameRefreshCommand(TextCommand, GitCmd):
-    HEADER_RE = re.compile(r'^(?P<sha>[0-9a-f]{40}) (\d+) (\d+) ?(\d+)?$')
+# entries start with "<sha> <orig line> <final line> <count>". no field
+# name is valid hex, so checking for a sha is enough to tell them apart
+HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+def is_blame_header(line):
+    return len(line) > 40 and line[40] == ' ' and HEX_DIGITS.issuperset(line[:40])
+
+
+def _strip_angle(value):
+    return value.strip('<>')
+
 
-    def parse_commit_line(self, commitline):
-        parts = commitline.split(' ', 1)
-        if len(parts) == 2:
-            fieldname, value = parts
+def _split_previous(value):
+    sha, filename = value.split(' ', 1)
+    return {'commit': sha, 'file': filename}
+
+
+# conversions for blame metadata fields, fields not listed are kept as strings
+_FIELD_HANDLERS = {
+    'author-time': int,
+    'author-mail': _strip_angle,
+    'previous': _split_previous,
+    'boundary': lambda value: True,
+}
+
+# metadata fields which are never displayed, and therefore not kept
+_IGNORED_FIELDS = frozenset(['committer', 'committer-mail', 'committer-time', 'committer-tz', 'author-tz'])
+
+
+def parse_commit_line(commitline):
+    fieldname, _, value = commitline.partition(' ')
+    value = value.strip()
+    handler = _FIELD_HANDLERS.get(fieldname)
+    return fieldname, handler(value) if handler else value
+
+
+def format_commit_date(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%a %b %d %H:%M:%S %Y")
+
+
+def abbreviate_commits(commits):
+    # the shortest unique abbreviation is one longer than the longest
+    # common prefix of any two neighbouring shas in sorted order
+    shas = sorted(commits)
+    abbrev_length = 7
+    for a, b in zip(shas, shas[1:]):
+        i = 0
+        while i < 40 and a[i] == b[i]:
+            i += 1
+        abbrev_length = max(abbrev_length, i + 1)
+    abbrev_length = min(abbrev_length, 40)
+
+    for k in commits:
+        commits[k]['abbrev'] = k[:abbrev_length]
+
+
+def parse_incremental(data, num_lines, progress=None):
+    """
+    Parse the output of ``git blame --incremental``.
+
+    Takes an iterable of output lines and the number of lines in the blamed
+    file. Returns a dict of commits by sha, and a list with the sha of each
+    line of the file. If given, ``progress`` is called with the commits, the
+    line shas and the number of blamed lines after each blame entry. Lines
+    which haven't been blamed yet have a sha of ``None``.
+    """
+    commits = {}
+    shas = [None] * num_lines
+    blamed = 0
+
+    # bind this locally, since it is looked up for every line of output
+    is_header = is_blame_header
+
+    commit = None
+    for item in data:
+        if is_header(item):
+            _, _, line, count = item.split(' ')
+            # all lines of a commit share the same sha string
+            sha = sys.intern(item[:40])
+            start = int(line) - 1
+            end = min(start + int(count), num_lines)
+            shas[start:end] = [sha] * (end - start)
+            blamed += end - start
+
+            commit = commits.get(sha)
+            if commit is None:
+                commit = commits[sha] = {'sha': sha}
+            continue
+
+        field, val = parse_commit_line(item)
+        if field in _IGNORED_FIELDS:
+            continue
+        commit[field] = val
+        if field == 'author-time':
+            commit['date'] = format_commit_date(val)
+        elif field == 'filename' and progress:
+            # the filename is always the last line of an entry
+            progress(commits, shas, blamed)
+
+    abbreviate_commits(commits)
+    return commits, shas
+
+
+class GitBlameRefreshCommand(TextCommand, GitCmd, GitBlameDiskCache):
+    # how often to show the partial results of a blame that is still running
+    PARTIAL_UPDATE_INTERVAL_S = 1
+
+    def get_contents(self, repo, filename, revision=None):
+        encoding = get_setting('encoding', 'utf-8')
+        fallback = get_setting('fallback_encodings', [])
+
+        if revision:
+            path = os.path.relpath(filename, repo) if os.path.isabs(filename) else filename
+            exit, content, _ = self.git(['cat-file', '-p', '%s:%s' % (revision, path.replace(os.sep, '/'))], cwd=repo)
+            if exit != 0:
+                return None
         else:
-            fieldname, value = parts[0], ''
-        value = value.strip()
-        if fieldname in ('committer-time', 'author-time'):
-            value = int(value)
-        elif fieldname in ('committer-mail', 'author-mail'):
-            value = value.strip('<>')
-        elif fieldname in ('previous',):
-            sha, filename = value.split(' ', 1)
-            value = {'commit': sha, 'file': filename}
-        elif fieldname in ('boundary',):
-            value = True
-        return fieldname, value
-
-    def get_blame(self, repo, filename, revision=None):
-        data = self.git_lines(['blame', '--porcelain', revision if revision else None, '--', filename], cwd=repo)
-
-        commits = {}
-        lines = []
-
-        current_commit = None
-        for l, item in enumerate(data, start=1):
             try:
-                headermatch = self.HEADER_RE.match(item)
-                if headermatch:
-                    sha = headermatch.group('sha')
-                    commits.setdefault(sha, {})['sha'] = sha
-                    current_commit = sha
-                elif item[0] == '\t':
-                    lines.append((current_commit, item[1:]))
-                else:
-                    field, val = self.parse_commit_line(item)
-                    commits.setdefault(current_commit, {})[field] = val
-            except Exception as e:
-                sublime.error_message('Error parsing git blame output: %s', e)
-                return {}, []
-
-        abbrev_length = 7
-        while abbrev_length < 40:
-            abbrevs = [c['sha'][:abbrev_length] for c in commits.values()]
-            if len(abbrevs) == len(set(abbrevs)):
-                break
-            abbrev_length += 1
-
-        for k in commits:
-            commits[k]['abbrev'] = commits[k]['sha'][:abbrev_length]
-
-        return commits, lines
-
-    def get_commit_date(self, commit):
-        return datetime.fromtimestamp(commit.get('author-time'))
-
-    def format_blame(self, commits, lines):
-        content = []
-        template = u"{boundary}{sha} {file}({author} {date}) {line}"
-
+                with open(os.path.join(repo, filename), 'rb') as f:
+                    content = self.decode(f.read(), encoding, fallback)
+            except IOError:
+                return None
+            except UnicodeDecodeError:
+                sublime.error_message(self.get_decoding_error(encoding, fallback))
+                return None
+
+        lines = content.replace('\r\n', '\n').split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        return lines
+
+    def get_blame(self, repo, filename, revision=None, rows=None):
+        contents = self.get_contents(repo, filename, revision)
+        if not contents:
+            return {}, [], []
+
+        data = self.git_stream_lines(['blame', '--incremental', revision if revision else None, '--', filename], cwd=repo)
+
+        last_update = time()
+
+        def progress(commits, shas, blamed):
+            nonlocal last_update
+            blame_async.set_progress("%s/%s lines" % (blamed, len(shas)))
+
+            # git finds the blame for recent changes first, so show what we have so far
+            if time() - last_update >= self.PARTIAL_UPDATE_INTERVAL_S:
+                abbreviate_commits(commits)
+                self.update_view(commits, shas, contents, rows)
+                last_update = time()
+
+        try:
+            commits, shas = parse_incremental(data, len(contents), progress)
+        except (ValueError, IndexError, TypeError, AttributeError) as e:
+            # this runs in a worker thread, so let the ui thread show the message
+            message = 'Error parsing git blame output: %s' % e
+            sublime.set_timeout(lambda: sublime.error_message(message), 0)
+            return {}, [], []
+
+        if None in shas:
+            # git didn't finish
+            return {}, [], []
+        return commits, shas, contents
+
+    def format_blame(self, commits, line_shas, line_contents):
         files = set(c.get('filename') for _, c in commits.items() if c.get('filename'))
         max_file = max(len(f) for f in files)
         max_name = max(len(c.get('author', '')) for _, c in commits.items())
         boundaries = any('boundary' in c for _, c in commits.items())
-
-        for sha, line in lines:
-            commit = commits.get(sha)
-            date = self.get_commit_date(commit)
-            c = template.format(
-                boundary='^' if 'boundary' in commit else (' ' if boundaries else ''),
-                sha=commit.get('abbrev'),
-                file=commit.get('filename').ljust(max_file + 1) if len(files) > 1 else '',
-                author=commit.get('author', '').ljust(max_name + 1, ' '),
-                date=date.strftime("%a %b %d %H:%M:%S %Y"),
-                line=line
+        multiple_files = len(files) > 1
+
+        # the column widths are known now, so bake them into the template
+        # once instead of padding every field separately
+        template = u"%%s%%s %s(%%-%ds %%s) " % (u"%%-%ds" % (max_file + 1) if multiple_files else u"%.0s", max_name + 1)
+
+        # everything but the line content is the same for all lines of a commit
+        prefixes = {}
+        for sha, commit in commits.items():
+            prefixes[sha] = template % (
+                '^' if 'boundary' in commit else (' ' if boundaries else ''),
+                commit.get('abbrev'),
+                commit.get('filename'),
+                commit.get('author', ''),
+                commit.get('date')
             )
-            content.append(c)
-        return "\n".join(content)
+        # lines which haven't been blamed yet
+        prefixes[None] = ' ' * max(len(p) for p in prefixes.values())
+
+        return "\n".join(prefixes[sha] + line for sha, line in zip(line_shas, line_contents))
+
+    def update_view(self, commits, line_shas, line_contents, rows=None):
+        blame = self.format_blame(commits, line_shas, line_contents)
+        self.view.run_command('git_blame_update_view', {'blame': blame, 'rows': rows})
 
     def is_visible(self):
         return False
 
-    @AsyncByView("Blame")
+    @blame_async
     def run(self, edit, filename=None, revision=None, rows=None):
-        filename = filename or self.view.settings().get('git_blame_file')
-        revision = revision or self.view.settings().get('git_blame_rev')
-        repo = self.view.settings().get('git_repo')
+        settings = self.view.settings()
+        filename = filename or settings.get('git_blame_file')
+        revision = revision or settings.get('git_blame_rev')
+        repo = settings.get('git_repo')
+
+        key = self.get_cache_key(repo, filename, revision)
+        cached = self.load_cached_blame(key) if key else None
+        if cached:
+            commits, line_shas, line_contents = cached
+        else:
+            commits, line_shas, line_contents = self.get_blame(repo, filename, revision, rows)
+            if key and commits and line_shas:
+                self.save_cached_blame(key, commits, line_shas, line_contents)
 
-        commits, lines = self.get_blame(repo, filename, revision)
-        if not commits or not lines:
+        if not commits or not line_shas:
             sublime.error_message("No results")
             self.view.close()
             return
-        GitBlameCache.commits[self.view.id()] = commits
-        GitBlameCache.lines[self.view.id()] = lines
-
-        blame = self.format_blame(commits, lines)
-        self.view.run_command('git_blame_update_view', {'blame': blame, 'lines': lines, 'rows': rows})
+        # only the shas are needed to look up the commit of a line later on
+        GitBlameCache.set(self.view.id(), commits, line_shas)
+        self.update_view(commits, line_shas, line_contents, rows)
 
 
 # Needs to be a separate command because the edit object can only be used synchronously
@@ -289,32 +563,40 @@ class GitBlameUpdateViewCommand(TextCommand):
     def is_visible(self):
         return False
 
-    def run(self, edit, blame, lines, rows=None):
+    def run(self, edit, blame, rows=None):
+        # partial results may already be showing, so keep the cursor where the user put it
+        first_update = self.view.size() == 0
+        if first_update:
+            row = rows[0] if rows else 0
+        else:
+            sel = self.view.sel()
+            row = self.view.rowcol(sel[0].begin())[0] if len(sel) > 0 else 0
+
         # write blame to file
         self.view.set_read_only(False)
-        if self.view.size() > 0:
-            self.view.erase(edit, sublime.Region(0, self.view.size()))
-        self.view.insert(edit, 0, blame)
+        self.view.replace(edit, sublime.Region(0, self.view.size()), blame)
         self.view.set_read_only(True)
 
+        # remember where the lines start, so rows can be looked up without the api
+        GitBlameCache.set_offsets(self.view.id(), blame)
+
         # mark lines selected
         if rows:
             lines = []
-            for row in rows:
-                lines.append(self.view.line(self.view.text_point(row, 0)))
+            for r in rows:
+                lines.append(self.view.line(self.view.text_point(r, 0)))
 
             # add dots in the sidebar
             self.view.add_regions('git-blame.lines', lines, 'git-blame.selection', 'dot', sublime.HIDDEN)
 
         # place cursor on same line as in old selection
-        row = rows[0] if rows else 0
         point = self.view.text_point(row, 0)
         self.view.sel().clear()
         self.view.sel().add(sublime.Region(point))
-        if not self.view.visible_region().contains(point):
-            sublime.set_timeout(lambda: self.view.show_at_center(point), 50)
-        self.view.window().focus_view(self.view)
-
+        if first_update:
+            if not self.view.visible_region().contains(point):
+                sublime.set_timeout(lambda: self.view.show_at_center(point), 50)
+            self.view.window().focus_view(self.view)
 
 
 class GitBlameEventListener(EventListener):
@@ -322,40 +604,40 @@ class GitBlameEventListener(EventListener):
 
     def on_selection_modified(self, view):
         if view.settings().get('git_view') == 'blame':
-            commits = GitBlameCache.commits.get(view.id())
-            lines = GitBlameCache.lines.get(view.id())
+            commits, shas, line_commits = GitBlameCache.get(view.id())
+            offsets = GitBlameCache.get_offsets(view.id())
 
-            if lines and commits:
-                row, col = view.rowcol(view.sel()[0].begin())
-                sha, line = lines[row]
-                commit = commits.get(sha)
+            if line_commits and commits and offsets:
+                row = row_at_point(offsets, view.sel()[0].begin())
+                commit = commits.get(shas[line_commits[row]])
                 if commit:
                     sublime.status_message(commit.get('summary'))
 
+    def on_close(self, view):
+        GitBlameCache.discard(view.id())
+
 
 class GitBlameTextCommand(GitRepoHelper):
 
     def commits_from_selection(self):
-        lines = GitBlameCache.lines.get(self.view.id())
-        commits = GitBlameCache.commits.get(self.view.id())
+        commits, shas, line_commits = GitBlameCache.get(self.view.id())
+        offsets = GitBlameCache.get_offsets(self.view.id())
 
-        if not lines or not commits:
+        if not line_commits or not commits or not offsets:
             return
 
-        linesets = [self.view.lines(s) for s in self.view.sel()]
         linenums = set()
-        for lineset in linesets:
-            for l in lineset:
-                row, _ = self.view.rowcol(l.begin())
-                linenums.add(row)
+        for s in self.view.sel():
+            first, last = row_at_point(offsets, s.begin()), row_at_point(offsets, s.end())
+            linenums.update(range(first, last + 1))
 
         if not linenums:
             return
 
         selected_commits = {}
         for n in linenums:
-            sha, _ = lines[n]
-            if sha not in selected_commits and set(sha) != set(['0']):
+            sha = shas[line_commits[n]]
+            if sha not in selected_commits and sha != ZERO_SHA:
                 selected_commits[sha] = commits.get(sha)
         return selected_commits
 
@@ -120,6 +120,45 @@ class Cmd(object):
             sublime.error_message(self.get_decoding_error(encoding, fallback))
             raise SublimeGitException("Could not execute command: %s" % command)
 
+    # streaming commands
+    def cmd_stream(self, cmd, cwd=None, encoding=None, fallback=None):
+        command = self.build_command(cmd)
+        environment = self.env()
+        encoding = encoding or get_setting('encoding', 'utf-8')
+        fallback = fallback or get_setting('fallback_encodings', [])
+
+        # stderr is discarded, since it's never read and could otherwise fill up and block
+        devnull = open(os.devnull, 'wb')
+
+        try:
+            logger.debug("stream-cmd: %s", command)
+
+            if cwd:
+                os.chdir(cwd)
+
+            proc = subprocess.Popen(command,
+                                    stdout=subprocess.PIPE,
+                                    stderr=devnull,
+                                    startupinfo=self.startupinfo(),
+                                    env=environment)
+        except OSError as e:
+            devnull.close()
+            sublime.error_message(self.get_executable_error())
+            raise SublimeGitException("Could not execute command: %s" % e)
+
+        try:
+            for line in iter(proc.stdout.readline, b''):
+                yield self.decode(line, encoding, fallback).rstrip('\n')
+        except UnicodeDecodeError:
+            sublime.error_message(self.get_decoding_error(encoding, fallback))
+            raise SublimeGitException("Could not execute command: %s" % command)
+        finally:
+            # if we stopped reading early, closing stdout makes the process exit
+            proc.stdout.close()
+            proc.wait()
+            devnull.close()
+            logger.debug("stream-exit: %s", proc.returncode)
+
     # async commands
     def cmd_async(self, cmd, cwd=None, **callbacks):
         command = self.build_command(cmd)
@@ -211,6 +250,9 @@ class GitCmd(GitRepoHelper, Cmd):
     def git_exit_code(self, cmd, *args, **kwargs):
         return self._exit_code(cmd, *args, **kwargs)
 
+    def git_stream_lines(self, cmd, *args, **kwargs):
+        return self.cmd_stream(cmd, *args, **kwargs)
+
     def git_async(self, cmd, *args, **kwargs):
         return self.cmd_async(cmd, *args, **kwargs)
 
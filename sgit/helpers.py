@@ -4,7 +4,7 @@ import os
 import logging
 import sublime
 
-from .util import get_setting
+from .util import get_setting, get_executable
 
 
 logger = logging.getLogger('SublimeGit.helpers')
@@ -286,6 +286,10 @@ class GitErrorHelper(object):
 
 
 class GitStatusHelper(object):
+    # git versions by executable and path, since status output depends on them
+    git_versions = {}
+
+    GIT_VERSION_RE = re.compile(r'(\d+)\.(\d+)')
 
     def file_in_git(self, repo, filename):
         return self.git_exit_code(['ls-files', filename, '--error-unmatch'], cwd=repo) == 0
@@ -305,30 +309,114 @@ class GitStatusHelper(object):
     #     return self.git_lines(cmd, cwd=repo)
 
     def get_porcelain_status(self, repo):
+        # porcelain v1 style lines, with renames as "R  orig -> new", or None if git failed
+        status = self.get_status_v2(repo)
+        if status is None:
+            return None
+        return ["%s %s" % (state, filename) for state, filename in status[1]]
+
+    def get_status_v2(self, repo, branch=False):
         mode = self.get_untracked_mode()
-        cmd = ['status', '-z', ('--untracked-files=%s' % mode) if mode else None]
+        return self.run_status(repo, [('--untracked-files=%s' % mode) if mode else None], branch=branch)
+
+    def run_status(self, repo, args, branch=False):
+        # porcelain v2 needs git 2.11, older versions get the v1 output in the same shape
+        version = self.get_git_version()
+        cmd = ['status', '--porcelain=v2' if version >= (2, 11) else '--porcelain', '-z']
+        if branch:
+            cmd.append('--branch')
+            # we only need the branch name, so don't let git count commits against the upstream
+            if version >= (2, 17):
+                cmd.append('--no-ahead-behind')
+        cmd.extend(args)
+
+        exit, output, stderr = self.git(cmd, cwd=repo)
+        if exit != 0:
+            # an empty status would look like a clean working dir, so say what went wrong
+            message = 'git error: %s' % stderr
+            sublime.set_timeout(lambda: sublime.error_message(message), 0)
+            return None
+
+        if version >= (2, 11):
+            return self.parse_status_v2(output)
+        return self.parse_status_v1(output)
+
+    def get_git_version(self):
+        key = (tuple(get_executable(self.executable, self.bin)), repr(get_setting('git_force_path', [])))
+        version = GitStatusHelper.git_versions.get(key)
+        if version is None:
+            # anything we can't make sense of gets the oldest formats, which every git understands
+            match = self.GIT_VERSION_RE.search(self.git_string(['--version']))
+            version = tuple(int(v) for v in match.groups()) if match else (0, 0)
+            GitStatusHelper.git_versions[key] = version
+        return version
+
+    def parse_status_v2(self, output):
+        # returns the branch headers, and the files as (XY, filename) like porcelain v1
+        branch = {}
+        entries = []
+        rows = output.split('\x00')
+        idx = 0
+        while idx < len(rows):
+            row = rows[idx]
+            kind = row[:1]
+            if kind == '#':
+                key, _, value = row[2:].partition(' ')
+                branch[key] = value
+            elif kind == '1':
+                parts = row.split(' ', 8)
+                entries.append((parts[1].replace('.', ' '), parts[8]))
+            elif kind == '2':
+                # renames and copies are followed by the original path
+                parts = row.split(' ', 9)
+                entries.append((parts[1].replace('.', ' '), "%s -> %s" % (rows[idx + 1], parts[9])))
+                idx += 1
+            elif kind == 'u':
+                parts = row.split(' ', 10)
+                entries.append((parts[1], parts[10]))
+            elif kind == '?':
+                entries.append(('??', row[2:]))
+            elif kind == '!':
+                entries.append(('!!', row[2:]))
+            idx += 1
+        return branch, entries
 
-        output = self.git_string(cmd, cwd=repo, strip=False)
+    def parse_status_v1(self, output):
+        # returns the same as parse_status_v2, with only the branch.head header
+        branch = {}
+        entries = []
         rows = output.split('\x00')
-        lines = []
         idx = 0
         while idx < len(rows):
             row = rows[idx]
-            if row and not row.startswith('#'):
-                status, filename = row[:2], row[3:]
-                if status[0] == 'R':
-                    lines.append("%s %s -> %s" % (status, rows[idx + 1], filename))
+            if row.startswith('## '):
+                head = row[3:]
+                for prefix in ('No commits yet on ', 'Initial commit on '):
+                    if head.startswith(prefix):
+                        head = head[len(prefix):]
+                if head.startswith('HEAD (no branch)'):
+                    head = '(detached)'
+                branch['branch.head'] = head.partition('...')[0]
+            elif row:
+                state, filename = row[:2], row[3:]
+                # renames and copies are followed by the original path
+                if state[0] in ('R', 'C'):
+                    entries.append((state, "%s -> %s" % (rows[idx + 1], filename)))
                     idx += 1
                 else:
-                    lines.append("%s %s" % (status, filename))
+                    entries.append((state, filename))
             idx += 1
-        return lines
+        return branch, entries
 
     def get_files_status(self, repo):
+        status = self.get_status_v2(repo)
+        if status is None:
+            return None
+        return self.split_files_status(status[1])
+
+    def split_files_status(self, entries):
         untracked, unstaged, staged = [], [], []
-        status = self.get_porcelain_status(repo)
-        for l in status:
-            state, filename = l[:2], l[3:]
+        for state, filename in entries:
             index, worktree = state
             if state in ('DD', 'AU', 'UD', 'UA', 'DU', 'AA', 'UU'):
                 logger.warning("unmerged WTF: %s, %s", state, filename)
@@ -56,11 +56,11 @@ class GitStashCommand(WindowCommand, GitCmd, GitStatusHelper):
             self.git(['stash', 'save', '--include-untracked' if untracked else None, '--', title], cwd=repo)
             self.window.run_command('git_status', {'refresh_only': True})
 
-        # update the index
-        self.git_exit_code(['update-index', '--refresh'], cwd=repo)
-
         # get files status
-        untracked_files, unstaged_files, _ = self.get_files_status(repo)
+        files_status = self.get_files_status(repo)
+        if files_status is None:
+            return
+        untracked_files, unstaged_files, _ = files_status
 
         # check for if there's something to stash
         if not unstaged_files:
@@ -2,6 +2,8 @@
 import os
 import logging
 import threading
+from time import time
+from bisect import bisect_left, bisect_right
 from functools import partial
 
 import sublime
@@ -94,76 +96,151 @@ GIT_STATUS_HELP = """
 
 
 class GitStatusBuilder(GitCmd, GitStatusHelper, GitRemoteHelper, GitStashHelper):
+    # header and stashes by repo, along with the signature they were built for
+    header_cache = {}
+
+    # files under .git which the header and stashes are built from
+    HEADER_SOURCES = ('HEAD', 'config', 'packed-refs', 'refs/stash', 'logs/refs/stash')
+
+    def get_header_signature(self, repo):
+        # worktrees and submodules have a .git file instead, don't bother with those
+        git_dir = os.path.join(repo, '.git')
+        if not os.path.isdir(git_dir):
+            return None
+
+        try:
+            with open(os.path.join(git_dir, 'HEAD')) as f:
+                head = f.read().strip()
+        except (IOError, OSError):
+            return None
+
+        sources = list(self.HEADER_SOURCES)
+        if head.startswith('ref: '):
+            sources.append(head[5:])
+
+        # git replaces files when writing them, so the inode changes even
+        # when the mtime resolution is too coarse to notice
+        signature = [head]
+        for source in sources:
+            try:
+                st = os.stat(os.path.join(git_dir, source))
+                signature.append((source, st.st_ino, st.st_mtime, st.st_size))
+            except OSError:
+                signature.append((source, None))
+        return tuple(signature)
 
     def build_status(self, repo):
-        branch = self.get_current_branch(repo)
-        remote = self.get_branch_remote(repo, branch)
-        remote_url = self.get_remote_url(repo, remote)
+        signature = self.get_header_signature(repo)
+        cached = GitStatusBuilder.header_cache.get(repo)
+
+        # git status refreshes the index itself, and only needs to give us the branch
+        # when the header has to be rebuilt
+        if signature and cached and cached[0] == signature:
+            status = self.get_status_v2(repo)
+            if status is None:
+                return None
+            _, entries = status
+            header = cached[1]
+        else:
+            # the rest of the header doesn't depend on the status, so run them all at once
+            status, head, stashes = self.run_in_threads(
+                partial(self.get_status_v2, repo, branch=True),
+                partial(self.git, ['log', '--max-count=1', '--abbrev-commit', '--pretty=oneline'], cwd=repo),
+                partial(self.build_stashes, repo)
+            )
+            # don't cache a header built without the branch
+            if status is None:
+                return None
+            branch_info, entries = status
+            header = self.build_header(repo, branch_info, head) + stashes
+            if signature:
+                GitStatusBuilder.header_cache[repo] = (signature, header)
+
+        parts = [header, self.build_files_status(repo, entries)]
+        if get_setting('git_show_status_help', True):
+            parts.append(GIT_STATUS_HELP)
 
-        abbrev_dir = abbreviate_dir(repo)
+        return "".join(parts)
 
-        head_rc, head, _ = self.git(['log', '--max-count=1', '--abbrev-commit', '--pretty=oneline'], cwd=repo)
+    def run_in_threads(self, *funcs):
+        # git commands mostly wait for the process, so they can overlap
+        results = [None] * len(funcs)
+        errors = []
 
-        status = ""
-        if remote:
-            status += "Remote:   %s @ %s\n" % (remote, remote_url)
-        status += "Local:    %s %s\n" % (branch if branch else '(no branch)', abbrev_dir)
-        status += "Head:     %s\n" % ("nothing committed (yet)" if head_rc != 0 else head)
-        status += "\n"
+        def run(idx, func):
+            try:
+                results[idx] = func()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=partial(run, idx, func)) for idx, func in enumerate(funcs)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def build_header(self, repo, branch_info, head):
+        branch = branch_info.get('branch.head')
+        if branch == '(detached)':
+            branch = None
+        remote = self.get_branch_remote(repo, branch) if branch else None
+        remote_url = self.get_remote_url(repo, remote) if remote else None
 
-        # update index
-        self.git_exit_code(['update-index', '--refresh'], cwd=repo)
+        abbrev_dir = abbreviate_dir(repo)
 
-        status += self.build_stashes(repo)
-        status += self.build_files_status(repo)
+        head_rc, head, _ = head
 
-        if get_setting('git_show_status_help', True):
-            status += GIT_STATUS_HELP
+        parts = []
+        if remote:
+            parts.append("Remote:   %s @ %s\n" % (remote, remote_url))
+        parts.append("Local:    %s %s\n" % (branch if branch else '(no branch)', abbrev_dir))
+        parts.append("Head:     %s\n" % ("nothing committed (yet)" if head_rc != 0 else head))
+        parts.append("\n")
 
-        return status
+        return "".join(parts)
 
     def build_stashes(self, repo):
-        status = ""
+        parts = []
 
         stashes = self.get_stashes(repo)
         if stashes:
-            status += SECTIONS[STASHES]
-            for name, title in stashes:
-                status += "\t%s: %s\n" % (name, title)
-            status += "\n"
+            parts.append(SECTIONS[STASHES])
+            parts.extend("\t%s: %s\n" % (name, title) for name, title in stashes)
+            parts.append("\n")
 
-        return status
+        return "".join(parts)
 
-    def build_files_status(self, repo):
-        # get status
-        status = ""
-        untracked, unstaged, staged = self.get_files_status(repo)
+    def build_files_status(self, repo, entries):
+        parts = []
+        untracked, unstaged, staged = self.split_files_status(entries)
+        label = STATUS_LABELS.__getitem__
 
         if not untracked and not unstaged and not staged:
-            status += GIT_WORKING_DIR_CLEAN + "\n"
+            parts.append(GIT_WORKING_DIR_CLEAN + "\n")
 
         # untracked files
         if untracked:
-            status += SECTIONS[UNTRACKED_FILES]
-            for s, f in untracked:
-                status += "\t%s\n" % f.strip()
-            status += "\n"
+            parts.append(SECTIONS[UNTRACKED_FILES])
+            parts.extend("\t%s\n" % f.strip() for s, f in untracked)
+            parts.append("\n")
 
         # unstaged changes
         if unstaged:
-            status += SECTIONS[UNSTAGED_CHANGES] if staged else SECTIONS[CHANGES]
-            for s, f in unstaged:
-                status += "\t%s %s\n" % (STATUS_LABELS[s], f)
-            status += "\n"
+            parts.append(SECTIONS[UNSTAGED_CHANGES] if staged else SECTIONS[CHANGES])
+            parts.extend("\t%s %s\n" % (label(s), f) for s, f in unstaged)
+            parts.append("\n")
 
         # staged changes
         if staged:
-            status += SECTIONS[STAGED_CHANGES]
-            for s, f in staged:
-                status += "\t%s %s\n" % (STATUS_LABELS[s], f)
-            status += "\n"
+            parts.append(SECTIONS[STAGED_CHANGES])
+            parts.extend("\t%s %s\n" % (label(s), f) for s, f in staged)
+            parts.append("\n")
 
-        return status
+        return "".join(parts)
 
 
 class GitStatusTextCmd(GitCmd):
@@ -175,6 +252,19 @@ class GitStatusTextCmd(GitCmd):
     def update_status(self, goto=None):
         self.view.run_command('git_status_refresh', {'goto': goto})
 
+    # selector helpers
+    def find_by_selector(self, selector):
+        # the results only change when the view does, so remember them until then
+        change_count = self.view.change_count()
+        cache = getattr(self, '_selector_cache', None)
+        if cache is None or cache[0] != change_count:
+            cache = self._selector_cache = (change_count, {})
+
+        regions = cache[1].get(selector)
+        if regions is None:
+            regions = cache[1][selector] = self.view.find_by_selector(selector)
+        return regions
+
     # selection commands
     def get_first_point(self):
         sels = self.view.sel()
@@ -187,18 +277,37 @@ class GitStatusTextCmd(GitCmd):
 
     # line helpers
     def get_selected_lines(self):
+        # status lines come back as a few sorted chunks, so look lines up in those
+        chunks = self.find_by_selector('meta.git-status.line')
+        starts = [c.begin() for c in chunks]
+
         sels = self.view.sel()
         selected_lines = []
         for selection in sels:
             lines = self.view.lines(selection)
             for line in lines:
-                if self.view.score_selector(line.begin(), 'meta.git-status.line') > 0:
+                idx = bisect_right(starts, line.begin()) - 1
+                if idx >= 0 and line.begin() < chunks[idx].end():
                     selected_lines.append(line)
         return selected_lines
 
+    def regions_in_lines(self, regions, lines):
+        # both are in document order (once the lines are sorted), so walk them
+        # together instead of checking every region against every line
+        lines = sorted(lines, key=lambda l: l.begin())
+        first = 0
+        for r in regions:
+            while first < len(lines) and lines[first].end() < r.begin():
+                first += 1
+            idx = first
+            while idx < len(lines) and lines[idx].begin() <= r.begin():
+                if lines[idx].contains(r):
+                    yield r, lines[idx]
+                idx += 1
+
     # stash helpers
     def get_all_stash_regions(self):
-        return self.view.find_by_selector('meta.git-status.stash.name')
+        return self.find_by_selector('meta.git-status.stash.name')
 
     def get_all_stashes(self):
         stashes = self.get_all_stash_regions()
@@ -209,17 +318,15 @@ class GitStatusTextCmd(GitCmd):
         lines = self.get_selected_lines()
 
         if lines:
-            for s in self.get_all_stash_regions():
-                for l in lines:
-                    if l.contains(s):
-                        name = self.view.substr(s)
-                        title = self.view.substr(self.view.line(s)).strip()
-                        stashes.append((name, title))
+            for s, l in self.regions_in_lines(self.get_all_stash_regions(), lines):
+                name = self.view.substr(s)
+                title = self.view.substr(self.view.line(s)).strip()
+                stashes.append((name, title))
         return stashes
 
     # file helpers
     def get_all_file_regions(self):
-        return self.view.find_by_selector('meta.git-status.file')
+        return self.find_by_selector('meta.git-status.file')
 
     def get_all_files(self):
         files = self.get_all_file_regions()
@@ -232,23 +339,21 @@ class GitStatusTextCmd(GitCmd):
         if not lines:
             return files
 
-        for f in self.get_all_file_regions():
-            for l in lines:
-                if l.contains(f):
-                    # check for renamed
-                    linestr = self.view.substr(l).strip()
-                    if linestr.startswith(STATUS_LABELS['R']) and ' -> ' in linestr:
-                        names = self.view.substr(f)
-                        # find position of divider
-                        e = names.find(' -> ')
-                        s = e + 4
-                        # add both files
-                        f1 = sublime.Region(f.begin(), f.begin() + e)
-                        f2 = sublime.Region(f.begin() + s, f.end())
-                        files.append((self.section_at_region(f), f1))
-                        files.append((self.section_at_region(f), f2))
-                    else:
-                        files.append((self.section_at_region(f), f))
+        for f, l in self.regions_in_lines(self.get_all_file_regions(), lines):
+            # check for renamed
+            linestr = self.view.substr(l).strip()
+            if linestr.startswith(STATUS_LABELS['R']) and ' -> ' in linestr:
+                names = self.view.substr(f)
+                # find position of divider
+                e = names.find(' -> ')
+                s = e + 4
+                # add both files
+                f1 = sublime.Region(f.begin(), f.begin() + e)
+                f2 = sublime.Region(f.begin() + s, f.end())
+                files.append((self.section_at_region(f), f1))
+                files.append((self.section_at_region(f), f2))
+            else:
+                files.append((self.section_at_region(f), f))
 
         return files
 
@@ -256,21 +361,44 @@ class GitStatusTextCmd(GitCmd):
         return [(s, self.view.substr(f)) for s, f in self.get_selected_file_regions()]
 
     def get_status_lines(self):
-        lines = []
-        chunks = self.view.find_by_selector('meta.git-status.line')
-        for c in chunks:
-            lines.extend(self.view.lines(c))
-        return lines
+        # kept with the selector results, so moving between items can reuse their bounds
+        change_count = self.view.change_count()
+        cache = getattr(self, '_status_lines_cache', None)
+        if cache is None or cache[0] != change_count:
+            lines = []
+            chunks = self.find_by_selector('meta.git-status.line')
+            for c in chunks:
+                lines.extend(self.view.lines(c))
+            cache = self._status_lines_cache = (change_count, lines)
+        return cache[1]
 
     # section helpers
     def get_sections(self):
-        sections = self.view.find_by_selector('constant.other.git-status.header')
+        sections = self.find_by_selector('constant.other.git-status.header')
         return sections
 
+    def get_section_intervals(self):
+        # sections don't overlap, so sorted by start they can be searched with bisect
+        change_count = self.view.change_count()
+        cached = getattr(self, '_section_intervals', None)
+        if cached and cached[0] == change_count:
+            return cached[1], cached[2]
+
+        intervals = []
+        for s in SECTIONS:
+            for r in self.find_by_selector(SECTION_SELECTOR_PREFIX + s):
+                intervals.append((r.begin(), r.end(), s))
+        intervals.sort()
+        starts = [i[0] for i in intervals]
+
+        self._section_intervals = (change_count, starts, intervals)
+        return starts, intervals
+
     def section_at_point(self, point):
-        for s in list(SECTIONS.keys()):
-            if self.view.score_selector(point, SECTION_SELECTOR_PREFIX + s) > 0:
-                return s
+        starts, intervals = self.get_section_intervals()
+        idx = bisect_right(starts, point) - 1
+        if idx >= 0 and point < intervals[idx][1]:
+            return intervals[idx][2]
 
     def section_at_region(self, region):
         return self.section_at_point(region.begin())
@@ -364,13 +492,29 @@ class GitStatusMoveCmd(GitStatusTextCmd):
     def move_to_region(self, region):
         self.move_to_point(self.view.line(region).begin())
 
+    def get_line_bounds(self, regions):
+        # regions are in document order, so the starts and ends of their lines are sorted.
+        # the region lists are cached until the view changes, so the list itself is the key
+        change_count = self.view.change_count()
+        cache = getattr(self, '_line_bounds_cache', None)
+        if cache is None or cache[0] != change_count:
+            cache = self._line_bounds_cache = (change_count, {})
+
+        bounds = cache[1].get(id(regions))
+        if bounds is None or bounds[0] is not regions:
+            lines = [self.view.line(r) for r in regions]
+            bounds = cache[1][id(regions)] = (regions, [l.begin() for l in lines], [l.end() for l in lines])
+        return bounds[1], bounds[2]
+
     def prev_region(self, regions, point):
-        before = [r for r in regions if self.view.line(r).end() < point]
-        return before[-1] if before else regions[-1]
+        _, ends = self.get_line_bounds(regions)
+        idx = bisect_left(ends, point) - 1
+        return regions[idx] if idx >= 0 else regions[-1]
 
     def next_region(self, regions, point):
-        after = [r for r in regions if self.view.line(r).begin() > point]
-        return after[0] if after else regions[0]
+        begins, _ = self.get_line_bounds(regions)
+        idx = bisect_right(begins, point)
+        return regions[idx] if idx < len(regions) else regions[0]
 
     def next_or_prev_region(self, direction, regions, point):
         if direction == "next":
@@ -379,12 +523,12 @@ class GitStatusMoveCmd(GitStatusTextCmd):
             return self.prev_region(regions, point)
 
     def move_to_section(self, which, where=None):
-        if which in range(1, 5):
+        if isinstance(which, int) and 1 <= which <= 4:
             sections = self.get_sections()
             if sections and len(sections) >= which:
                 section = sections[which - 1]
                 self.move_to_region(section)
-        elif which in list(SECTIONS.keys()):
+        elif which in SECTIONS:
             sections = self.get_sections()
             for section in sections:
                 if self.section_at_region(section) == which:
@@ -415,9 +559,10 @@ class GitStatusMoveCmd(GitStatusTextCmd):
                     self.move_to_region(self.view.line(files[-1]))
             elif self.get_all_stash_regions():
                 self.move_to_stash(1)
-            elif self.view.find(GIT_WORKING_DIR_CLEAN, 0, sublime.LITERAL):
+            else:
                 region = self.view.find(GIT_WORKING_DIR_CLEAN, 0, sublime.LITERAL)
-                self.move_to_region(region)
+                if region:
+                    self.move_to_region(region)
         elif which in ('next', 'prev'):
             point = self.get_first_point()
             regions = self.get_all_file_regions()
@@ -428,12 +573,14 @@ class GitStatusMoveCmd(GitStatusTextCmd):
             regions = self.get_all_file_regions()
             section_regions = [r for r in regions if self.section_at_region(r) == where]
             if section_regions:
-                prev_regions = [r for r in section_regions if self.view.substr(r) < which]
-                next_regions = [r for r in section_regions if self.view.substr(r) >= which]
-                if next_regions:
-                    next = next_regions[0]
-                else:
-                    next = prev_regions[-1]
+                # renames are listed by their new name, so the names aren't
+                # necessarily sorted; take the first one at or after which
+                names = [self.view.substr(r) for r in section_regions]
+                next = section_regions[-1]
+                for name, region in zip(names, section_regions):
+                    if name >= which:
+                        next = region
+                        break
                 self.move_to_region(next)
             else:
                 sections = set([self.section_at_region(r) for r in regions])
@@ -449,15 +596,12 @@ class GitStatusMoveCmd(GitStatusTextCmd):
 
     def move_to_stash(self, which, where=None):
         if which is not None and where:
-            which = str(which)
             stash_regions = self.get_all_stash_regions()
             if stash_regions:
-                prev_regions = [r for r in stash_regions if self.view.substr(r) < which]
-                next_regions = [r for r in stash_regions if self.view.substr(r) >= which]
-                if next_regions:
-                    next = next_regions[0]
-                else:
-                    next = prev_regions[-1]
+                # stashes are listed in order, but compare them as numbers so 10 comes after 9
+                nums = [int(self.view.substr(r)) for r in stash_regions]
+                idx = bisect_left(nums, int(which))
+                next = stash_regions[idx] if idx < len(stash_regions) else stash_regions[-1]
                 self.move_to_region(next)
             else:
                 self.move_to_file(1)
@@ -506,35 +650,80 @@ class GitStatusCommand(WindowCommand, GitStatusBuilder):
 class GitStatusRefreshCommand(TextCommand, GitStatusBuilder, GitStatusMoveCmd):
     _lpop = False
 
+    # ids of views with a status being built, and the goto to refresh with
+    # again when a refresh is requested in the meantime. these are only
+    # touched from the ui thread, so the handoff needs no locking
+    refreshing = set()
+    pending = {}
+
     def is_visible(self):
         return False
 
-    def run(self, edit, goto=None):
+    def run(self, edit, goto=None, status=None):
         if not self.view.settings().get('git_view') == 'status':
             return
 
-        repo = self.get_repo()
-        if not repo:
-            return
+        if status is None:
+            repo = self.get_repo()
+            if not repo:
+                return
+
+            if not hasattr(sublime, 'set_timeout_async'):
+                # sublime text 2 has no worker thread, so build it right here
+                status = self.build_status(repo)
+            else:
+                view_id = self.view.id()
+                if view_id in GitStatusRefreshCommand.refreshing:
+                    GitStatusRefreshCommand.pending[view_id] = goto
+                    return
+                GitStatusRefreshCommand.refreshing.add(view_id)
+                sublime.set_timeout_async(partial(self.build_status_async, repo, goto), 0)
+                return
+        else:
+            self.finish_refresh()
 
-        status = self.build_status(repo)
         if not status:
             return
 
         self.view.set_read_only(False)
         self.view.replace(edit, sublime.Region(0, self.view.size()), status)
         self.view.set_read_only(True)
+        self.view.settings().set('git_status_last_refresh', time())
 
         if goto:
             self.goto(goto)
         else:
             self.goto(GOTO_DEFAULT)
 
+    def build_status_async(self, repo, goto):
+        # always hand back to the ui thread, even if building failed, so the refresh gets finished
+        status = ''
+        try:
+            status = self.build_status(repo) or ''
+        finally:
+            sublime.set_timeout(partial(self.view.run_command, 'git_status_refresh', {'goto': goto, 'status': status}), 0)
+
+    def finish_refresh(self):
+        view_id = self.view.id()
+        GitStatusRefreshCommand.refreshing.discard(view_id)
+
+        # the repo might have changed while building, so refresh again
+        if view_id in GitStatusRefreshCommand.pending:
+            goto = GitStatusRefreshCommand.pending.pop(view_id)
+            sublime.set_timeout(partial(self.view.run_command, 'git_status_refresh', {'goto': goto}), 0)
+
 
 class GitStatusEventListener(EventListener):
+    # don't refresh on focus if the view was refreshed less than this long ago
+    REFRESH_INTERVAL_S = 0.25
 
     def on_activated(self, view):
         if view.settings().get('git_view') == 'status' and get_setting('git_update_status_on_focus', True):
+            # focus often bounces back and forth, e.g. when we focus the view ourselves
+            last_refresh = view.settings().get('git_status_last_refresh', 0)
+            if time() - last_refresh < self.REFRESH_INTERVAL_S:
+                return
+
             goto = None
             if view.sel():
                 goto = "point:%s" % view.sel()[0].begin()
@@ -544,6 +733,12 @@ class GitStatusEventListener(EventListener):
 class GitStatusBarUpdater(threading.Thread, GitCmd):
     _lpop = False
 
+    # current branch by repo, along with the stat of HEAD it was read for
+    branches = {}
+
+    # the latest updater by view id, so slower older ones can't overwrite its status
+    generations = {}
+
     def __init__(self, bin, encoding, fallback, repo, kind, view, *args, **kwargs):
         super(GitStatusBarUpdater, self).__init__(*args, **kwargs)
         self.bin = bin
@@ -553,13 +748,36 @@ class GitStatusBarUpdater(threading.Thread, GitCmd):
         self.kind = kind
         self.view = view
 
+        self.generation = GitStatusBarUpdater.generations.get(view.id(), 0) + 1
+        GitStatusBarUpdater.generations[view.id()] = self.generation
+
+    def is_current(self):
+        return GitStatusBarUpdater.generations.get(self.view.id()) == self.generation
+
     def build_command(self, cmd):
         return self.bin + self.opts + [c for c in cmd if c]
 
-    def run(self):
+    def get_branch(self):
+        # HEAD is replaced whenever the branch changes, so its stat tells us when to ask git again
+        try:
+            st = os.stat(os.path.join(self.repo, '.git', 'HEAD'))
+            signature = (st.st_ino, st.st_mtime, st.st_size)
+        except OSError:
+            signature = None
+
+        cached = GitStatusBarUpdater.branches.get(self.repo)
+        if signature and cached and cached[0] == signature:
+            return cached[1]
+
         branch = self.git_string(['symbolic-ref', '-q', 'HEAD'], cwd=self.repo,
                                  ignore_errors=True, encoding=self.encoding, fallback=self.fallback)
-        if not branch:
+        if signature:
+            GitStatusBarUpdater.branches[self.repo] = (signature, branch)
+        return branch
+
+    def run(self):
+        branch = self.get_branch()
+        if not branch or not self.is_current():
             return
 
         branch = branch[11:] if branch.startswith('refs/heads/') else branch
@@ -567,10 +785,10 @@ class GitStatusBarUpdater(threading.Thread, GitCmd):
         if self.kind == 'simple':
             msg = "On {branch}".format(branch=branch)
         else:
-            self.git_exit_code(['update-index', '--refresh'], cwd=self.repo, encoding=self.encoding, fallback=self.fallback)
             unpushed = self.git_exit_code(['diff', '--exit-code', '--quiet', '@{upstream}..'], cwd=self.repo, encoding=self.encoding, fallback=self.fallback)
             staged = self.git_exit_code(['diff-index', '--quiet', '--cached', 'HEAD'], cwd=self.repo, encoding=self.encoding, fallback=self.fallback)
-            unstaged = self.git_exit_code(['diff-index', '--quiet', 'HEAD'], cwd=self.repo, encoding=self.encoding, fallback=self.fallback)
+            # unlike diff-index, diff checks the contents of stat-dirty files itself
+            unstaged = self.git_exit_code(['diff', '--quiet', 'HEAD'], cwd=self.repo, encoding=self.encoding, fallback=self.fallback)
             msg = 'On {branch}{dirty} in {repo}{unpushed}'.format(
                 branch=branch,
                 dirty='*' if (staged or unstaged) else '',
@@ -578,8 +796,11 @@ class GitStatusBarUpdater(threading.Thread, GitCmd):
                 unpushed=' with unpushed' if unpushed == 1 else ''
             )
 
-        sublime.set_timeout(partial(self.view.set_status, 'git-status', msg), 0)
-        # self.view.set_status('git-status', msg)
+        sublime.set_timeout(partial(self.set_status, msg), 0)
+
+    def set_status(self, msg):
+        if self.is_current():
+            self.view.set_status('git-status', msg)
 
 
 class GitStatusBarEventListener(EventListener, GitCmd):
@@ -655,6 +876,8 @@ class GitQuickStatusCommand(WindowCommand, GitCmd, GitStatusHelper):
             return
 
         status = self.get_porcelain_status(repo)
+        if status is None:
+            return
         if not status:
             status = [GIT_WORKING_DIR_CLEAN]
 
@@ -849,42 +1072,43 @@ class GitStatusIgnoreCommand(TextCommand, GitStatusTextCmd):
         return self.confirm(self.IGNORE_TRACKED, patterns, u"Continue")
 
     def confirm(self, message, patterns, button):
-        msg = message
-        msg += "\n\n"
-        msg += "\n".join(patterns[:10])
-        if len(patterns) > 10:
-            msg += "\n"
-            msg += "(%s more...)" % len(patterns) - 10
+        more = "\n(%s more...)" % (len(patterns) - 10) if len(patterns) > 10 else ""
+        msg = "%s\n\n%s%s" % (message, "\n".join(patterns[:10]), more)
         return sublime.ok_cancel_dialog(msg, button)
 
     def add_to_gitignore(self, repo, patterns):
         gitignore = os.path.join(repo, '.gitignore')
-        contents = []
+        content = ''
 
         # read existing gitignore
         if os.path.exists(gitignore):
-            with open(gitignore, 'r+') as f:
-                contents = [l.strip() for l in f]
-        logger.debug('Initial .gitignore: %s', contents)
+            with open(gitignore, 'r') as f:
+                content = f.read()
+        existing = set(l.strip() for l in content.splitlines())
+        logger.debug('Initial .gitignore: %s', existing)
 
-        # add new patterns to the end
+        # only the new patterns need to be written
+        added = []
         for p in patterns:
-            if p not in contents:
+            if p not in existing:
                 logger.debug('Adding to .gitignore: %s', p)
-                contents.append(p)
+                existing.add(p)
+                added.append(p)
 
-        # always add a newline
-        contents.append('')
+        if not added:
+            return added
 
-        # write gitignore
-        with open(gitignore, 'w+') as f:
-            f.write("\n".join(contents))
-        logger.debug('Final .gitignore: %s', contents)
+        # append to gitignore, making sure we start on a new line
+        with open(gitignore, 'a') as f:
+            if content and not content.endswith('\n'):
+                f.write("\n")
+            f.write("\n".join(added) + "\n")
+        logger.debug('Added to .gitignore: %s', added)
 
-        return contents
+        return added
 
 
-class GitStatusDiscardCommand(TextCommand, GitStatusTextCmd):
+class GitStatusDiscardCommand(TextCommand, GitStatusTextCmd, GitStatusHelper):
 
     DELETE_UNTRACKED_CONFIRMATION = "Delete all untracked files and directories?"
 
@@ -897,7 +1121,6 @@ class GitStatusDiscardCommand(TextCommand, GitStatusTextCmd):
         if discard == "section":
             points = self.get_all_points()
             sections = set([self.section_at_point(p) for p in points])
-            all_files = self.get_all_files()
 
             if STASHES in sections:
                 self.discard_all_stashes(repo)
@@ -905,9 +1128,12 @@ class GitStatusDiscardCommand(TextCommand, GitStatusTextCmd):
             if UNTRACKED_FILES in sections:
                 self.discard_all_untracked(repo)
 
-            files = [i for i in all_files if i[0] in (UNSTAGED_CHANGES, STAGED_CHANGES)]
-            if files:
-                self.discard_files(repo, files)
+            # only look up the files if a section with changes was selected
+            changes = sections & set([UNSTAGED_CHANGES, STAGED_CHANGES])
+            if changes:
+                files = [i for i in self.get_all_files() if i[0] in changes]
+                if files:
+                    self.discard_files(repo, files)
 
         elif discard == "item":
             files = self.get_selected_files()
@@ -952,11 +1178,16 @@ class GitStatusDiscardCommand(TextCommand, GitStatusTextCmd):
                 self.git(['stash', 'drop', '--quiet', 'stash@{%s}' % n], cwd=repo)
 
     def discard_files(self, repo, files):
+        # get the status of all the files in one go
+        states = self.get_discard_states(repo, [f for s, f in files if s != UNTRACKED_FILES])
+        if states is None:
+            return
+
         # See if any of the files cannot be discarded
         error = "You can't discard staged changes to the following files. Please unstage them first:\n\n  {errfiles}"
         errlist = []
         for s, f in files:
-            if s == STAGED_CHANGES and not self.is_up_to_date(repo, f):
+            if s == STAGED_CHANGES and not self.is_up_to_date(states, f):
                 errlist.append(f)
 
         if errlist:
@@ -968,11 +1199,7 @@ class GitStatusDiscardCommand(TextCommand, GitStatusTextCmd):
         confirm = "Are you sure you want to perform the following actions?\n\n  {actions}"
         actionlist = []
         for s, f in files:
-            staged = s == STAGED_CHANGES
-            status = self.get_staging_status(repo, f) if staged else self.get_worktree_status(repo, f)
-
-            if staged and f in errlist:
-                continue
+            status = self.get_file_status(states, s, f)
 
             if s == UNTRACKED_FILES or status == 'N':
                 action = 'Delete: '
@@ -990,43 +1217,78 @@ class GitStatusDiscardCommand(TextCommand, GitStatusTextCmd):
         if not sublime.ok_cancel_dialog(confirm.format(actions=actions), 'Continue'):
             return
 
-        # perform various unstaging/deleting/resurrection actions
+        # sort the files by what needs to be done to them
+        untracked, deleted, new, staged, unstaged = [], [], [], [], []
         for s, f in files:
-            staged = s == STAGED_CHANGES
-            status = self.get_staging_status(repo, f) if staged else self.get_worktree_status(repo, f)
-
-            if staged and not self.is_up_to_date(repo, f):
-                continue
+            status = self.get_file_status(states, s, f)
 
             if s == UNTRACKED_FILES:
-                self.git(['clean', '-d', '--force', '--', f], cwd=repo)
+                untracked.append(f)
             elif status == 'D':
-                self.git(['reset', '-q', '--', f], cwd=repo)
-                self.git(['checkout', '--', f], cwd=repo)
+                deleted.append(f)
             elif status == 'N':
-                self.git(['rm', '-f', '--', f], cwd=repo)
+                new.append(f)
+            elif s == STAGED_CHANGES:
+                # files which aren't in HEAD can't be checked out from it, and
+                # would make git refuse to check out any of the others
+                if status != 'A':
+                    staged.append(f)
             else:
-                if staged:
-                    self.git(['checkout', 'HEAD', '--', f], cwd=repo)
-                else:
-                    self.git(['checkout', '--', f], cwd=repo)
+                unstaged.append(f)
 
-    # status helpers
-
-    def is_up_to_date(self, repo, filename):
-        return self.git_exit_code(['diff', '--quiet', '--', filename], cwd=repo) == 0
+        # perform various unstaging/deleting/resurrection actions
+        for paths in self.chunk_paths(untracked):
+            self.git(['clean', '-d', '--force', '--'] + paths, cwd=repo)
+        for paths in self.chunk_paths(deleted):
+            self.git(['reset', '-q', '--'] + paths, cwd=repo)
+            self.git(['checkout', '--'] + paths, cwd=repo)
+        for paths in self.chunk_paths(new):
+            self.git(['rm', '-f', '--'] + paths, cwd=repo)
+        for paths in self.chunk_paths(staged):
+            self.git(['checkout', 'HEAD', '--'] + paths, cwd=repo)
+        for paths in self.chunk_paths(unstaged):
+            self.git(['checkout', '--'] + paths, cwd=repo)
 
-    def get_worktree_status(self, repo, filename):
-        output = self.git_string(['diff', '--name-status', '--', filename], cwd=repo)
-        if output:
-            status, _ = output.split('\t')
-            return status
+    # status helpers
 
-    def get_staging_status(self, repo, filename):
-        output = self.git_string(['diff', '--name-status', '--cached', '--', filename], cwd=repo)
-        if output:
-            status, _ = output.split('\t')
-            return status
+    # stay well below the command line length limit on windows
+    MAX_PATHS_LENGTH = 16000
+
+    def chunk_paths(self, paths):
+        chunk, length = [], 0
+        for path in paths:
+            if chunk and length + len(path) > self.MAX_PATHS_LENGTH:
+                yield chunk
+                chunk, length = [], 0
+            chunk.append(path)
+            # room for quoting and the separator
+            length += len(path) + 3
+        if chunk:
+            yield chunk
+
+    def get_discard_states(self, repo, filenames):
+        # returns the XY status of each of the given files which has changes,
+        # or None if git failed, since then we can't tell what is safe to discard
+        states = {}
+        renames = '--no-renames' if self.get_git_version() >= (2, 18) else None
+        for paths in self.chunk_paths(filenames):
+            status = self.run_status(repo, [renames, '--untracked-files=no', '--'] + paths)
+            if status is None:
+                return None
+            for state, f in status[1]:
+                states[f] = state
+        return states
+
+    def is_up_to_date(self, states, filename):
+        state = states.get(filename)
+        return state is None or state[1] == ' '
+
+    def get_file_status(self, states, section, filename):
+        state = states.get(filename)
+        if state:
+            status = state[0] if section == STAGED_CHANGES else state[1]
+            if status != ' ':
+                return status
 
 
 class GitStatusStashCmd(GitStatusTextCmd, GitStashHelper, GitErrorHelper):